@@ -1,6 +1,7 @@
 # SPDX-FileCopyrightText: 2021 Torgny Bjers
 #
 # SPDX-License-Identifier: Unlicense
+import array
 import gc
 import time
 
@@ -8,32 +9,80 @@ import adafruit_logging as logging
 import adafruit_pm25
 import adafruit_sht31d
 import alarm
+import analogio
 import board
 import digitalio
 import microcontroller
+import neopixel
 import rtc
 import supervisor
+import wifi
 from adafruit_bitmap_font import bitmap_font
 from adafruit_bitmap_font.bdf import BDF
 from adafruit_bitmap_font.pcf import PCF
 from adafruit_bitmap_font.ttf import TTF
-from adafruit_display_text import label
+from adafruit_display_text import bitmap_label, label
 from adafruit_magtag.magtag import MagTag
 from adafruit_pm25.i2c import PM25_I2C
 from adafruit_lc709203f import LC709203F
 
 from constants import (
+    EINK_MAX_SKIPPED_REFRESHES,
+    EMA_FULL_SAMPLE_INTERVAL,
+    GC_MEM_FREE_THRESHOLD,
     MAXIMUM_BACKOFF,
     MAX_BACKOFF_COUNT,
     MINIMUM_BACKOFF,
+    PM25_SAMPLE_BUDGET_SECONDS,
+    PM25_SENSOR_STABILIZE_SECONDS,
     PM25_SENSOR_WARMUP_SECONDS,
     PM25_STANDBY_PIN,
     REFRESH_TIME,
     SLEEP_MEMORY_SLOT_BACKOFF,
     SLEEP_MEMORY_SLOT_BACKOFF_TIMES,
+    SLEEP_MEMORY_SLOT_EMA_VALID,
+    SLEEP_MEMORY_SLOT_EMA_VALUES,
+    SLEEP_MEMORY_SLOT_EMA_WAKES,
+    SLEEP_MEMORY_SLOT_LAST_PM_VALUES,
+    SLEEP_MEMORY_SLOT_LAST_WAKE,
+    SLEEP_MEMORY_SLOT_REFRESH_SKIPS,
+    SLEEP_MEMORY_SLOT_WIFI_HINT,
 )
 from logger import get_logger
 
+# Ambient light thresholds mapped to neopixel brightness, darkest first
+_BRIGHTNESS_LUT = ((700, 0.5), (1500, 0.75), (2000, 1.0))
+
+# Caption and x position for each PM value column on the display
+_LABEL_SPECS = (('PM 1.0', 53), ('PM 2.5', 148), ('PM 10', 243))
+
+# Feed keys for the averages shown in the large value labels, in column order
+_VALUE_LABEL_KEYS = ('pm10-standard', 'pm25-standard', 'pm100-standard')
+
+# Column names returned by adafruit_pm25's read(), in frame order
+_PM25_COLUMNS = (
+    'pm10 standard', 'pm25 standard', 'pm100 standard',
+    'pm10 env', 'pm25 env', 'pm100 env',
+    'particles 03um', 'particles 05um', 'particles 10um',
+    'particles 25um', 'particles 50um', 'particles 100um',
+)
+
+# Adafruit IO feed key for each column, computed once at import time so the
+# averaging loop never allocates replacement strings
+_PM25_FEED_KEYS = tuple(column.replace(' ', '-') for column in _PM25_COLUMNS)
+
+# Template for the particle-count stats line at the bottom of the display
+_STATS_FMT = ('0.3µm/0.1L: %.1f, 0.5µm/0.1L: %.1f, 1.0µm/0.1L: %.1f\n'
+              '2.5µm/0.1L: %.1f, 5.0µm/0.1L: %.1f, 10µm/0.1L: %.1f')
+
+
+def _maybe_collect() -> None:
+    """
+    Collect garbage only when free memory is actually running low.
+    """
+    if gc.mem_free() < GC_MEM_FREE_THRESHOLD:
+        gc.collect()
+
 
 def clear_backoff() -> None:
     """
@@ -43,6 +92,43 @@ def clear_backoff() -> None:
     alarm.sleep_memory[SLEEP_MEMORY_SLOT_BACKOFF_TIMES] = 0
 
 
+def store_last_sleep_time() -> None:
+    """
+    Record the current monotonic time in the sleep memory before deep sleep.
+    """
+    now = int(time.monotonic())
+    for offset in range(4):
+        alarm.sleep_memory[SLEEP_MEMORY_SLOT_LAST_WAKE + offset] = (now >> (8 * offset)) & 0xFF
+
+
+def read_ema_value(index: int) -> int:
+    """
+    Read one stored PM25 running average from the sleep memory.
+    """
+    base = SLEEP_MEMORY_SLOT_EMA_VALUES + index * 2
+    return alarm.sleep_memory[base] | (alarm.sleep_memory[base + 1] << 8)
+
+
+def store_ema_value(index: int, value: float) -> None:
+    """
+    Store one PM25 running average in the sleep memory.
+    """
+    fixed = min(65535, max(0, int(value + 0.5)))
+    base = SLEEP_MEMORY_SLOT_EMA_VALUES + index * 2
+    alarm.sleep_memory[base] = fixed & 0xFF
+    alarm.sleep_memory[base + 1] = fixed >> 8
+
+
+def read_last_sleep_time() -> int:
+    """
+    Read the monotonic time at which we last entered deep sleep.
+    """
+    last = 0
+    for offset in range(4):
+        last |= alarm.sleep_memory[SLEEP_MEMORY_SLOT_LAST_WAKE + offset] << (8 * offset)
+    return last
+
+
 class AqMagTag:
     """AqMagTag uses MagTag and abstracts away the complexities.
 
@@ -76,6 +162,7 @@ class AqMagTag:
     _connected: bool = False
     _debug: bool = False
     _debug_display: bool = False
+    _ema_active: bool = False
     _i2c: board.I2C = None
     _label_font: [BDF, PCF, TTF] = None
     _led_pin_io: digitalio.DigitalInOut = None
@@ -83,13 +170,18 @@ class AqMagTag:
     _num_samples: int = 0
     _numbers_font: [BDF, PCF, TTF] = None
     _pm25: adafruit_pm25.PM25 = None
+    _pm25_averages: dict = None
+    _pm25_count: int = 0
     _pm25_standby_pin_io: digitalio.DigitalInOut = None
+    _pm25_sums: array.array = None
     _relative_humidity: float = 0
     _rtc: rtc.RTC = None
     _secrets: dict = {}
     _sht31d = None
     _stats_font: [BDF, PCF, TTF] = None
     _temperature: float = 0
+    _warmup_seconds: int = 0
+    _warmup_start: float = 0
 
     # public properties
     initialized: bool = False
@@ -98,11 +190,14 @@ class AqMagTag:
     def __init__(self, debug: bool = False, debug_display: bool = False) -> None:
         self._debug = bool(debug)
         self._debug_display = bool(debug_display)
-        self._num_samples = 1 if self._debug else 10
+        self._num_samples = 1 if self._debug else 5
+        # Preallocate the sample accumulators once so every wake reuses the
+        # same long-lived dict instead of fragmenting the heap.
+        self._pm25_sums = array.array('f', (0.0 for _ in _PM25_COLUMNS))
+        self._pm25_averages = {feed_key: 0.0 for feed_key in _PM25_FEED_KEYS}
+        self._pm25_count = 0
         self.log = get_logger('aq_magtag')
         self.log.setLevel(logging.DEBUG if self._debug else logging.INFO)
-        if not gc.isenabled():
-            gc.enable()
 
     def setup(self) -> None:
         """
@@ -112,14 +207,24 @@ class AqMagTag:
             return
         self.log.info('Start setup...')
         self._setup_alarms()
+        if isinstance(alarm.wake_alarm, alarm.pin.PinAlarm):
+            self._flashlight_path()
         self._setup_digital_pins()
+        self._plan_sampling()
         self._start_sensor_warmup()
         self._setup_magtag()
-        self._handle_alarms()
-        self._setup_sensors()
-        self._check_battery()
+        # Fonts and labels live for the whole run; allocating them before
+        # the churny sensor and network bring-up keeps the big buffers at
+        # the quiet end of the heap. Collect right before and after so the
+        # big PCF bitmaps land in a contiguous region.
+        gc.collect()
         self._load_fonts()
         self._setup_labels()
+        gc.collect()
+        self._handle_alarms()
+        self._check_battery()
+        self._setup_sensors()
+        self._wait_for_warmup_completion()
         self.initialized = True
         self.log.info('Setup complete.')
 
@@ -127,14 +232,14 @@ class AqMagTag:
         """
         Create the necessary alarms needed to wake back up from a deep sleep.
         """
-        self.log.debug(f'Alarm type: {alarm.wake_alarm}')
-        # Set up alarms for the different buttons and timer
+        self.log.debug('Alarm type: %s', alarm.wake_alarm)
+        # Set up the wake alarm for the flashlight button; the timer alarm
+        # is built in deep_sleep() just before it is needed.
         self.pin_alarm = alarm.pin.PinAlarm(board.D14, value=False)
-        self.time_alarm = alarm.time.TimeAlarm(monotonic_time=int(time.monotonic()) + REFRESH_TIME)
         self.log.info('Alarm setup complete.')
         if alarm.wake_alarm:
             self._alarm_triggered = True
-            self.log.info(f'Alarm [{alarm.wake_alarm.__class__}] triggered.')
+            self.log.info('Alarm [%s] triggered.', alarm.wake_alarm.__class__)
 
     def _setup_digital_pins(self) -> None:
         """
@@ -150,51 +255,125 @@ class AqMagTag:
         self._pm25_standby_pin_io.value = False
         self.log.info('Set up PM25 standby pin.')
 
-    def _start_sensor_warmup(self) -> None:
+    def _plan_sampling(self) -> None:
         """
-        Warm up the PM25 sensor so that it is ready to sample.
+        Decide how many PM25 samples this wake needs.
+
+        With running averages carried across wakes in sleep memory, a
+        single sample blended into the stored average smooths just as well
+        as a full burst, so most wakes only read once. A full multi-sample
+        reading still runs on cold boot and periodically to reseed the
+        average.
+        """
+        if self._debug:
+            return
+        wakes = alarm.sleep_memory[SLEEP_MEMORY_SLOT_EMA_WAKES]
+        if (alarm.wake_alarm is not None
+                and alarm.sleep_memory[SLEEP_MEMORY_SLOT_EMA_VALID]
+                and wakes < EMA_FULL_SAMPLE_INTERVAL):
+            self._ema_active = True
+            self._num_samples = 1
+            alarm.sleep_memory[SLEEP_MEMORY_SLOT_EMA_WAKES] = wakes + 1
+        else:
+            alarm.sleep_memory[SLEEP_MEMORY_SLOT_EMA_WAKES] = 0
+
+    def _start_sensor_warmup(self) -> None:
         """
-        self.log.info(f'Waiting {PM25_SENSOR_WARMUP_SECONDS}s for sensor to warm up...')
+        Start warming up the PM25 sensor so that it is ready to sample.
+
+        The full warmup is only needed from a cold start. When we wake from
+        a recent deep sleep the fan and laser were running not long ago, so
+        a short stabilization wait is enough. Only the fan needs to spin;
+        the rest of setup runs while it does, and
+        _wait_for_warmup_completion sleeps off whatever time is left.
+        """
+        self._warmup_seconds = PM25_SENSOR_WARMUP_SECONDS or 30
+        if alarm.wake_alarm is not None:
+            last_sleep = read_last_sleep_time()
+            elapsed = int(time.monotonic()) - last_sleep
+            if last_sleep and elapsed < REFRESH_TIME + 60:
+                self._warmup_seconds = PM25_SENSOR_STABILIZE_SECONDS
+            if (last_sleep and elapsed < 60
+                    and alarm.sleep_memory[SLEEP_MEMORY_SLOT_BACKOFF_TIMES] > 0):
+                # A backoff retry this soon after sleeping means the fan
+                # barely stopped; no warmup is needed at all.
+                self._warmup_seconds = 0
+        self.log.info('Started %ds sensor warmup...', self._warmup_seconds)
         self._pm25_standby_pin_io.value = True
-        time.sleep(PM25_SENSOR_WARMUP_SECONDS or 30)
+        self._warmup_start = time.monotonic()
+
+    def _wait_for_warmup_completion(self) -> None:
+        """
+        Sleep off whatever is left of the PM25 warmup started earlier.
+        """
+        remaining = self._warmup_seconds - (time.monotonic() - self._warmup_start)
+        if remaining > 0:
+            self.log.info('Waiting %ds for sensor warmup to complete...', remaining)
+            # Light sleep instead of a busy wait; only the fan needs power
+            # while the warmup runs out.
+            alarm.light_sleep_until_alarms(
+                alarm.time.TimeAlarm(monotonic_time=time.monotonic() + remaining))
+
+    def _flashlight_path(self) -> None:
+        """
+        Serve a flashlight request without the cost of a full boot.
+
+        Woken by the button pin alarm the user only wants light, so skip
+        the MagTag, font, label, and sensor setup entirely and just power
+        the neopixels before going back to sleep.
+        """
+        self._alarm_pin = alarm.wake_alarm.pin
+        self.log.info('Triggered by %s pin alarm.', self._alarm_pin)
+        # Check what the light level is before we blind someone
+        light_sensor = analogio.AnalogIn(board.LIGHT)
+        light = light_sensor.value
+        neopixel_brightness = 0.25
+        for threshold, brightness in _BRIGHTNESS_LUT:
+            if light < threshold:
+                neopixel_brightness = brightness
+                break
+        self.log.debug('brightness = %s', neopixel_brightness)
+        neopixel_power = digitalio.DigitalInOut(board.NEOPIXEL_POWER)
+        neopixel_power.switch_to_output(value=False)
+        neopixels = neopixel.NeoPixel(board.NEOPIXEL, 4, brightness=neopixel_brightness)
+        neopixels.fill((255, 255, 255))
+        # Deep sleep would reset the power-gate pin and cut the light, so
+        # idle in light sleep while the pixels are lit, then shut them off
+        # and deep-sleep out the rest of the normal refresh interval.
+        alarm.light_sleep_until_alarms(
+            alarm.time.TimeAlarm(monotonic_time=time.monotonic() + 6))
+        neopixels.fill((0, 0, 0))
+        neopixels.deinit()
+        neopixel_power.value = True
+        store_last_sleep_time()
+        time_alarm = alarm.time.TimeAlarm(monotonic_time=int(time.monotonic()) + REFRESH_TIME)
+        alarm.exit_and_deep_sleep_until_alarms(self.pin_alarm, time_alarm)
 
     def _handle_alarms(self) -> None:
         """
         Determine if alarms have been triggered. If so, process them.
         """
-        debug_messages = []
-
-        # Check to see if the wake alarm is a pin alarm
-        if isinstance(alarm.wake_alarm, alarm.pin.PinAlarm):
-            self._alarm_pin = alarm.wake_alarm.pin
-            self.log.info(f'Triggered by {self._alarm_pin} pin alarm.')
-            debug_messages.append(str(self._alarm_pin))
-            # Check what the light level is before we blind someone
-            neopixel_brightness = 0.25
-            if self._magtag.peripherals.light < 700:
-                neopixel_brightness = 0.5
-            if self._magtag.peripherals.light < 1500:
-                neopixel_brightness = 0.75
-            if self._magtag.peripherals.light < 2000:
-                neopixel_brightness = 1
-            debug_messages.append(f'brightness = {neopixel_brightness}')
-            self._magtag.peripherals.neopixel_disable = False
-            self._magtag.peripherals.neopixels.brightness = neopixel_brightness
-            self._magtag.peripherals.neopixels.fill((255, 255, 255))
-            self._magtag.peripherals.neopixels.show()
-            self.log.debug('\n'.join(debug_messages))
-            time.sleep(6)
-            self.deep_sleep()
-        elif isinstance(alarm.wake_alarm, alarm.time.TimeAlarm):
+        if isinstance(alarm.wake_alarm, alarm.time.TimeAlarm):
             # If we have received a time alarm, proceed with boot.
+            neopixels = self._magtag.peripherals.neopixels
+            # Light sleep between color transitions instead of busy-waiting;
+            # the pixels hold their state while the core idles.
             for i in range(4):
-                time.sleep(0.5)
-                self._magtag.peripherals.neopixels[0] = (255, 255, 0)
-                time.sleep(0.25)
-                self._magtag.peripherals.neopixels[0] = (0, 0, 0)
+                alarm.light_sleep_until_alarms(
+                    alarm.time.TimeAlarm(monotonic_time=time.monotonic() + 0.5))
+                neopixels[0] = (255, 255, 0)
+                neopixels.show()
+                alarm.light_sleep_until_alarms(
+                    alarm.time.TimeAlarm(monotonic_time=time.monotonic() + 0.25))
+                neopixels[0] = (0, 0, 0)
+                neopixels.show()
         elif not alarm.wake_alarm:
             self._magtag.set_background(0x666666)
             board.DISPLAY.refresh()
+            # Restore the white background for the data frames; nothing
+            # else repaints it now that process_events no longer sets the
+            # background every wake.
+            self._magtag.set_background(0xFFFFFF)
         self.log.info('Handled alarms.')
 
     def _check_battery(self) -> None:
@@ -202,7 +381,7 @@ class AqMagTag:
         Check the battery level, if it's low, play a tone.
         """
         if self._magtag.peripherals.battery < 3.5:
-            self.log.info(f'low battery at {self._magtag.peripherals.battery}')
+            self.log.info('low battery at %s', self._magtag.peripherals.battery)
             if not supervisor.runtime.usb_connected:
                 for i in range(3):
                     self._magtag.peripherals.play_tone(2600, 0.1)
@@ -216,6 +395,10 @@ class AqMagTag:
         self._pm25 = PM25_I2C(self._i2c, None)
         self.log.info('Connected PM25 sensor via I2C.')
         self._sht31d = adafruit_sht31d.SHT31D(self._i2c)
+        # One single-shot low-repeatability conversion is plenty for room
+        # readings and keeps the sensor's on-time short.
+        self._sht31d.mode = adafruit_sht31d.MODE_SINGLE
+        self._sht31d.repeatability = adafruit_sht31d.REP_LOW
         self.log.info('Connected SHT31D sensor via I2C.')
         self._battery_sensor = LC709203F(self._i2c)
 
@@ -227,14 +410,16 @@ class AqMagTag:
         self._magtag = MagTag(default_bg=0xFFFFFF, debug=self._debug or self._debug_display)
         # noinspection PyProtectedMember
         self._secrets = self._magtag.network._secrets
-        # Default configuration for MagTag
-        self._magtag.peripherals.neopixels.auto_write = True
+        # Default configuration for MagTag. auto_write stays off so pixel
+        # state only hits the bus on an explicit show().
+        self._magtag.peripherals.neopixels.auto_write = False
         self._magtag.peripherals.neopixels.brightness = 255
         # Set up the Real Time Clock
         self._rtc = rtc.RTC()
         self._magtag.peripherals.neopixels[0] = (0, 40, 0)
+        self._magtag.peripherals.neopixels.show()
         self.log.info('MagTag initiated.')
-        self.log.debug(f'Battery at {self._magtag.peripherals.battery} volt.')
+        self.log.debug('Battery at %s volt.', self._magtag.peripherals.battery)
 
     def _load_fonts(self) -> None:
         """
@@ -243,66 +428,47 @@ class AqMagTag:
         self._label_font = bitmap_font.load_font("fonts/FredokaOne-Regular-18.pcf")
         self._numbers_font = bitmap_font.load_font("fonts/FredokaOne-Regular-46.pcf")
         self._stats_font = bitmap_font.load_font("fonts/Tamzen-9.pcf")
+        # Preload just the glyphs we actually render so their bitmaps are
+        # parsed once and allocated in one contiguous batch at setup rather
+        # than lazily in the middle of a refresh.
+        self._label_font.load_glyphs('PM 0125.')
+        self._numbers_font.load_glyphs('0123456789')
+        self._stats_font.load_glyphs('0123456789.,:/Lmµ ')
         self.log.info('Fonts loaded.')
 
     def _setup_labels(self) -> None:
         """
         Create the labels that we use to display information on the screen.
         """
-        self._pm10value_label = label.Label(
-            self._numbers_font,
-            color=0x000000,
-            anchor_point=(0.5, 0.5),
-            anchored_position=(53, 35),
-        )
-        self._pm10label_label = label.Label(
-            self._label_font,
-            color=0x666666,
-            text="PM 1.0",
-            anchor_point=(0.5, 0.5),
-            anchored_position=(53, 70),
-        )
-        self._pm25value_label = label.Label(
-            self._numbers_font,
-            color=0x000000,
-            anchor_point=(0.5, 0.5),
-            anchored_position=(148, 35),
-        )
-        self._pm25label_label = label.Label(
-            self._label_font,
-            color=0x666666,
-            text="PM 2.5",
-            anchor_point=(0.5, 0.5),
-            anchored_position=(148, 70),
-        )
-        self._pm100value_label = label.Label(
-            self._numbers_font,
-            color=0x000000,
-            anchor_point=(0.5, 0.5),
-            anchored_position=(243, 35),
-        )
-        self._pm100label_label = label.Label(
-            self._label_font,
-            color=0x666666,
-            text="PM 10",
-            anchor_point=(0.5, 0.5),
-            anchored_position=(243, 70),
-        )
+        self._value_labels = []
+        for caption, x_position in _LABEL_SPECS:
+            value_label = label.Label(
+                self._numbers_font,
+                color=0x000000,
+                anchor_point=(0.5, 0.5),
+                anchored_position=(x_position, 35),
+            )
+            # Captions never change, so render them as a single packed bitmap
+            # and let go of the cached string right away.
+            caption_label = bitmap_label.Label(
+                self._label_font,
+                color=0x666666,
+                text=caption,
+                save_text=False,
+                anchor_point=(0.5, 0.5),
+                anchored_position=(x_position, 70),
+            )
+            self._value_labels.append(value_label)
+            self._magtag.splash.append(value_label)
+            self._magtag.splash.append(caption_label)
         self._stats_label = label.Label(
             self._stats_font,
             color=0x000000,
             anchor_point=(0, 0),
             anchored_position=(12, 100),
         )
-        self._magtag.splash.append(self._pm10value_label)
-        self._magtag.splash.append(self._pm10label_label)
-        self._magtag.splash.append(self._pm25value_label)
-        self._magtag.splash.append(self._pm25label_label)
-        self._magtag.splash.append(self._pm100value_label)
-        self._magtag.splash.append(self._pm100label_label)
         self._magtag.splash.append(self._stats_label)
-        if gc.isenabled():
-            gc.collect()
+        _maybe_collect()
         self.log.info('Labels created.')
 
     def deep_sleep(self, backoff: bool = False) -> None:
@@ -312,19 +478,26 @@ class AqMagTag:
         Args:
             backoff: if True, then we use an exponential backoff strategy
         """
+        _maybe_collect()
         self._magtag.peripherals.neopixel_disable = True
         self._magtag.peripherals.speaker_disable = True
         if not isinstance(alarm.wake_alarm, alarm.pin.PinAlarm):
             self._pm25_standby_pin_io.value = False
+        store_last_sleep_time()
+        # Release the I2C pins and the neopixel output before sleeping;
+        # pins left claimed keep their drivers powered and leak current
+        # through deep sleep.
+        if self._i2c:
+            self._i2c.deinit()
+        self._magtag.peripherals.deinit()
         if backoff:
             sleep_length = alarm.sleep_memory[SLEEP_MEMORY_SLOT_BACKOFF]
-            self.log.error(f'EXPONENTIAL BACKOFF: Sleeping for {sleep_length} seconds.')
+            self.log.error('EXPONENTIAL BACKOFF: Sleeping for %d seconds.', sleep_length)
             backoff_alarm = alarm.time.TimeAlarm(monotonic_time=int(time.monotonic()) + sleep_length)
             alarm.exit_and_deep_sleep_until_alarms(backoff_alarm)
-        self.log.info(f'Sleeping for {REFRESH_TIME:d} seconds')
-        if gc.isenabled():
-            gc.collect()
-        alarm.exit_and_deep_sleep_until_alarms(self.pin_alarm, self.time_alarm)
+        self.log.info('Sleeping for %d seconds', REFRESH_TIME)
+        time_alarm = alarm.time.TimeAlarm(monotonic_time=int(time.monotonic()) + REFRESH_TIME)
+        alarm.exit_and_deep_sleep_until_alarms(self.pin_alarm, time_alarm)
 
     def deep_sleep_exponential_backoff(self) -> None:
         """
@@ -337,8 +510,8 @@ class AqMagTag:
         if not sleep_time:
             sleep_time = MINIMUM_BACKOFF
             backoff_count = 0
-        if MINIMUM_BACKOFF < sleep_time < MAXIMUM_BACKOFF:
-            sleep_time *= 2
+        elif sleep_time << 1 <= MAXIMUM_BACKOFF:
+            sleep_time <<= 1
         backoff_count += 1
         alarm.sleep_memory[SLEEP_MEMORY_SLOT_BACKOFF] = sleep_time
         alarm.sleep_memory[SLEEP_MEMORY_SLOT_BACKOFF_TIMES] = backoff_count
@@ -346,12 +519,48 @@ class AqMagTag:
             raise ConnectionError('Unable to connect after backoff expired')
         self.deep_sleep(backoff=True)
 
+    def _connect_with_hint(self) -> None:
+        """
+        Try associating with the access point cached in sleep memory.
+
+        Passing the stored BSSID and channel lets the radio skip the full
+        scan, which is most of the association time. A failed attempt is
+        harmless; the normal connect path runs afterwards either way.
+        """
+        channel = alarm.sleep_memory[SLEEP_MEMORY_SLOT_WIFI_HINT]
+        if not channel:
+            return
+        bssid = bytes(alarm.sleep_memory[SLEEP_MEMORY_SLOT_WIFI_HINT + 1 + offset]
+                      for offset in range(6))
+        try:
+            wifi.radio.connect(self._secrets['ssid'], self._secrets['password'],
+                               bssid=bssid, channel=channel)
+        except (ConnectionError, ValueError):
+            self.log.warning('Cached access point unavailable, falling back to scan.')
+            alarm.sleep_memory[SLEEP_MEMORY_SLOT_WIFI_HINT] = 0
+
+    def _store_wifi_hint(self) -> None:
+        """
+        Cache the connected access point for the next wake's fast path.
+        """
+        ap_info = wifi.radio.ap_info
+        if ap_info is None:
+            return
+        bssid = ap_info.bssid
+        for offset in range(6):
+            alarm.sleep_memory[SLEEP_MEMORY_SLOT_WIFI_HINT + 1 + offset] = bssid[offset]
+        alarm.sleep_memory[SLEEP_MEMORY_SLOT_WIFI_HINT] = ap_info.channel
+
     def connect(self) -> None:
         """
         Connect to the WiFi network.
         """
-        self._magtag.peripherals.neopixels[0] = (70, 70, 10)
+        peripherals = self._magtag.peripherals
+        neopixels = peripherals.neopixels
+        neopixels[0] = (70, 70, 10)
+        neopixels.show()
 
+        self._connect_with_hint()
         while self._connect_tries <= 5:
             try:
                 self._magtag.network.connect()
@@ -366,62 +575,97 @@ class AqMagTag:
         if not self._connected:
             self.log.warning('Cannot connect to network. Sleeping for five minutes.')
             for i in range(5):
-                self._magtag.peripherals.play_tone(1200, 0.05)
+                peripherals.play_tone(1200, 0.05)
                 time.sleep(0.09)
             self._magtag.exit_and_deep_sleep(60 * 5)
         else:
             self.log.info('Connection established.')
+            self._store_wifi_hint()
 
-        self._magtag.peripherals.neopixels[0] = (0, 255, 0)
-
-        time.sleep(3)
+        neopixels[0] = (0, 255, 0)
+        neopixels.show()
 
-        self._magtag.peripherals.neopixels[0] = 0
-        if gc.isenabled():
-            gc.collect()
-
-    def get_pm25_measurements(self) -> []:
+    def get_pm25_measurements(self) -> None:
         """
-        Get a number of measurements over time to get an average from the instrument.
+        Sum up a number of measurements from the instrument for averaging.
+
+        Totals accumulate into the array preallocated in __init__, so each
+        sample can be released to the garbage collector right away and no
+        per-cycle containers are allocated.
         """
-        measurements = []
+        sums = self._pm25_sums
+        for index in range(len(sums)):
+            sums[index] = 0.0
+        count = 0
         failed_readings = 0
-        self.log.info(f'Take {self._num_samples} samples from PM25 sensor.')
+        self.log.info('Take %d samples from PM25 sensor.', self._num_samples)
+        neopixels = self._magtag.peripherals.neopixels
+        # The yellow and green progress colors are debug-only; errors
+        # always show red.
+        if self._debug:
+            neopixels[0] = (255, 255, 0)
+            neopixels.show()
+        started = time.monotonic()
         for c in range(self._num_samples):
-            if failed_readings > 3:
-                self._magtag.peripherals.neopixels[0] = (255, 0, 0)
-                self.deep_sleep_exponential_backoff()
-            self._magtag.peripherals.neopixels[0] = (255, 255, 0)
-            time.sleep(0.25)
-            try:
-                measurements.append(self._pm25.read())
-                self._magtag.peripherals.neopixels[0] = (0, 255, 0)
-                time.sleep(0.25)
-            except RuntimeError:
-                self.log.warning('Unable to read from sensor, retrying...')
+            aqdata = None
+            for attempt in range(3):
+                try:
+                    aqdata = self._pm25.read()
+                    break
+                except OSError:
+                    # The sensor dropped off the bus entirely; retrying the
+                    # remaining samples would just burn awake time.
+                    self.log.error('PM25 I2C bus error.')
+                    neopixels[0] = (255, 0, 0)
+                    neopixels.show()
+                    self.deep_sleep_exponential_backoff()
+                except RuntimeError:
+                    self.log.warning('Unable to read from sensor, retrying...')
+                    # Give the sensor one inter-frame interval before retrying
+                    time.sleep(0.1)
+            if aqdata is None:
                 failed_readings += 1
-                self._magtag.peripherals.neopixels[0] = (255, 0, 0)
+                if failed_readings > 3:
+                    neopixels[0] = (255, 0, 0)
+                    neopixels.show()
+                    self.deep_sleep_exponential_backoff()
                 continue
+            for index, column in enumerate(_PM25_COLUMNS):
+                sums[index] += aqdata[column]
+            count += 1
+            aqdata = None
+            if count > self._num_samples // 2 and time.monotonic() - started > PM25_SAMPLE_BUDGET_SECONDS:
+                self.log.warning('Sample budget exceeded, stopping at %d samples.', count)
+                break
+        if self._debug:
+            neopixels[0] = (0, 255, 0)
+            neopixels.show()
+        self._pm25_count = count
         self.log.info('PM25 samples collected.')
-        if gc.isenabled():
-            gc.collect()
-        return measurements
-
-    def get_pm25_averages(self, measurements: []):
-        """
-        Get the average from the collected measurements.
-        """
-        pm25_averages = {}
-        if measurements and len(measurements):
-            columns = measurements[0].keys()
-            for column in columns:
-                feed_key = column.replace(' ', '-')
-                pm25_averages[feed_key] = sum(i[column] for i in measurements) / len(measurements)
-                if not self._debug:
-                    self.push_to_io(feed_key=f'air-quality-office.{feed_key}', metadata={},
-                                    data=pm25_averages[feed_key], precision=2)
-        if gc.isenabled():
-            gc.collect()
+
+    def get_pm25_averages(self):
+        """
+        Get the average from the collected measurement totals.
+        """
+        pm25_averages = self._pm25_averages
+        if not self._pm25_count:
+            if self._ema_active:
+                # The lone sample of an EMA wake failed; report the stored
+                # averages rather than the zeros the accumulators reset to,
+                # and leave the sleep memory untouched.
+                self.log.warning('No samples collected, reusing stored averages.')
+                for index, feed_key in enumerate(_PM25_FEED_KEYS):
+                    pm25_averages[feed_key] = read_ema_value(index)
+            return pm25_averages
+        for index, feed_key in enumerate(_PM25_FEED_KEYS):
+            value = self._pm25_sums[index] / self._pm25_count
+            if self._ema_active:
+                # Blend the single fresh sample into the average
+                # carried across wakes: new = (7 * old + sample) / 8
+                value = (read_ema_value(index) * 7 + value) / 8
+            pm25_averages[feed_key] = value
+            store_ema_value(index, value)
+        alarm.sleep_memory[SLEEP_MEMORY_SLOT_EMA_VALID] = 1
         return pm25_averages
 
     def push_to_io(self, feed_key: str, metadata: any, data: any, precision=0) -> bool:
@@ -440,17 +684,11 @@ class AqMagTag:
         """
         failed_push = False
         if self._debug:
-            self.log.debug(f'Not pushing {feed_key} to Adafruit IO in debug mode.')
+            self.log.debug('Not pushing %s to Adafruit IO in debug mode.', feed_key)
         else:
-            self.log.info(f'Push {feed_key} to Adafruit IO.')
-            for x in range(3):
+            self.log.info('Push %s to Adafruit IO.', feed_key)
+            for x in range(2):
                 try:
-                    # TODO: Fix neopixels aren't working when pushing to feed
-                    #       For some reason this isn't working while the MagTag is also pushing out
-                    #       stats to the Adafruit IO API. Gotta be a way to have that light blink.
-                    self._magtag.peripherals.neopixels[1] = (255, 0, 255)
-                    time.sleep(0.25)
-                    self._magtag.peripherals.neopixels[1] = (0, 255, 255)
                     self._magtag.push_to_io(feed_key=feed_key, metadata=metadata, data=data, precision=precision)
                     failed_push = False
                     break
@@ -460,65 +698,141 @@ class AqMagTag:
                     continue
         return failed_push
 
+    def push_group_to_io(self, group_key: str, feeds: dict) -> bool:
+        """Push a whole group of values to Adafruit IO in one request.
+
+        Adafruit IO accepts a single POST per feed group, so publishing all
+        feeds together costs one TLS round trip instead of one per feed.
+
+        Args:
+            group_key: feed group to publish to
+            feeds: mapping of feed key to value
+
+        Returns:
+            True or False indicate success.
+        """
+        failed_push = False
+        if self._debug:
+            self.log.debug('Not pushing group %s to Adafruit IO in debug mode.', group_key)
+            return failed_push
+        self.log.info('Push %d feeds to Adafruit IO group %s.', len(feeds), group_key)
+        url = f'https://io.adafruit.com/api/v2/{self._secrets["aio_username"]}/groups/{group_key}/data'
+        payload = {'feeds': [{'key': key, 'value': round(value, 2)} for key, value in feeds.items()]}
+        # One retry only: if Adafruit IO is down or rate limiting, the
+        # exponential backoff sleep is far cheaper than hammering the radio.
+        for x in range(2):
+            try:
+                response = self._magtag.network.requests.post(
+                    url, json=payload, headers={'X-AIO-KEY': self._secrets['aio_key']})
+                try:
+                    # adafruit_requests does not raise on HTTP errors, so a
+                    # rate limit or server error still returns a Response.
+                    if response.status_code >= 400:
+                        self.log.warning('Adafruit IO returned %d.', response.status_code)
+                        failed_push = True
+                    else:
+                        failed_push = False
+                finally:
+                    response.close()
+                if not failed_push:
+                    break
+                time.sleep(1)
+            except (RuntimeError, OSError):
+                failed_push = True
+                time.sleep(1)
+                continue
+        return failed_push
+
     def get_sht31d_readings(self):
         self.log.info('Get readings from SHT31D.')
         try:
-            self._temperature = self._sht31d.temperature
-            self._relative_humidity = self._sht31d.relative_humidity
+            # Read temperature and humidity in one measurement instead of
+            # triggering a separate conversion per property.
+            # noinspection PyProtectedMember
+            self._temperature, self._relative_humidity = self._sht31d._data()
         except OSError:
             return False
-        success = True
-        success & self.push_to_io(
-            feed_key='air-quality-office.temperature-c',
-            metadata={},
-            data=self._temperature,
-            precision=1,
+        self.log.info('SHT31D samples collected.')
+        return True
+
+    def _refresh_display(self, pm25_averages: dict) -> None:
+        """
+        Refresh the display, skipping the refresh when nothing has changed.
+
+        A full e-ink refresh is the most expensive part of a wake cycle and
+        the panel keeps its image through deep sleep, so when the rounded PM
+        values match what is already on screen we leave the panel alone. A
+        refresh is forced on cold boot and after EINK_MAX_SKIPPED_REFRESHES
+        consecutive skips to keep the stats line from going stale.
+        """
+        values = tuple(
+            min(65535, max(0, int(pm25_averages[key] + 0.5)))
+            for key in _VALUE_LABEL_KEYS
         )
-        success & self.push_to_io(
-            feed_key='air-quality-office.relative-humidity',
-            metadata={},
-            data=self._relative_humidity,
-            precision=1,
+        shown = tuple(
+            alarm.sleep_memory[SLEEP_MEMORY_SLOT_LAST_PM_VALUES + i * 2]
+            | (alarm.sleep_memory[SLEEP_MEMORY_SLOT_LAST_PM_VALUES + i * 2 + 1] << 8)
+            for i in range(3)
         )
-        self.log.info('SHT31D samples collected.')
-        return success
+        skips = alarm.sleep_memory[SLEEP_MEMORY_SLOT_REFRESH_SKIPS]
+        if alarm.wake_alarm is not None and values == shown and skips < EINK_MAX_SKIPPED_REFRESHES:
+            alarm.sleep_memory[SLEEP_MEMORY_SLOT_REFRESH_SKIPS] = skips + 1
+            self.log.info('Displayed values unchanged, skipping refresh.')
+            return
+        # Collect the cycle's string garbage before the display allocates
+        # its transfer buffers against a fragmented heap.
+        gc.collect()
+        board.DISPLAY.show(self._magtag.splash)
+        # The e-ink driver enforces a minimum interval between refreshes
+        if board.DISPLAY.time_to_refresh > 0:
+            time.sleep(board.DISPLAY.time_to_refresh)
+        board.DISPLAY.refresh()
+        for i, value in enumerate(values):
+            alarm.sleep_memory[SLEEP_MEMORY_SLOT_LAST_PM_VALUES + i * 2] = value & 0xFF
+            alarm.sleep_memory[SLEEP_MEMORY_SLOT_LAST_PM_VALUES + i * 2 + 1] = value >> 8
+        alarm.sleep_memory[SLEEP_MEMORY_SLOT_REFRESH_SKIPS] = 0
 
     def process_events(self) -> None:
         """
         Process events. Call this from the main loop of your `code.py` file.
         """
-        self._magtag.set_background(0xFFFFFF)
+        neopixels = self._magtag.peripherals.neopixels
+        # Clear the connection acknowledgement left on by connect()
+        neopixels[0] = 0
+        neopixels.show()
+
+        sht31d_ok = self.get_sht31d_readings()
+        neopixels[1] = (0, 80, 0)
+        neopixels.show()
+        self.get_pm25_measurements()
+        pm25_averages = self.get_pm25_averages()
+
+        for value_label, key in zip(self._value_labels, _VALUE_LABEL_KEYS):
+            value_label.text = f'{pm25_averages[key]:.0f}'
+
+        self._stats_label.text = _STATS_FMT % (
+            pm25_averages['particles-03um'],
+            pm25_averages['particles-05um'],
+            pm25_averages['particles-10um'],
+            pm25_averages['particles-25um'],
+            pm25_averages['particles-50um'],
+            pm25_averages['particles-100um'],
+        )
 
-        self.get_sht31d_readings()
-        self._magtag.peripherals.neopixels[1] = (0, 80, 0)
-        pm25_averages = self.get_pm25_averages(self.get_pm25_measurements())
-        self._magtag.peripherals.neopixels[1] = (0, 80, 0)
+        self._refresh_display(pm25_averages)
 
+        # Publish only after the display is updated, so a slow or failing
+        # network cannot delay what the user sees.
         if not self._debug:
-            self.push_to_io(
-                feed_key='air-quality-office.battery-percentage',
-                metadata={},
-                data=self._battery_sensor.cell_percent,
-                precision=2,
-            )
-            self.push_to_io(
-                feed_key='air-quality-office.battery-voltage',
-                metadata={},
-                data=self._battery_sensor.cell_voltage,
-                precision=2,
-            )
-
-        self._pm10value_label.text = f'{pm25_averages["pm10-standard"]:.0f}'
-        self._pm25value_label.text = f'{pm25_averages["pm25-standard"]:.0f}'
-        self._pm100value_label.text = f'{pm25_averages["pm100-standard"]:.0f}'
-
-        stats = f'0.3µm/0.1L: {pm25_averages["particles-03um"]:.1f}, 0.5µm/0.1L: {pm25_averages["particles-05um"]:.1f}, 1.0µm/0.1L: {pm25_averages["particles-10um"]:.1f}\n'
-        stats += f'2.5µm/0.1L: {pm25_averages["particles-25um"]:.1f}, 5.0µm/0.1L: {pm25_averages["particles-50um"]:.1f}, 10µm/0.1L: {pm25_averages["particles-100um"]:.1f}'
-
-        self._stats_label.text = stats
-
-        board.DISPLAY.show(self._magtag.splash)
-        board.DISPLAY.refresh()
+            feeds = dict(pm25_averages)
+            if sht31d_ok:
+                feeds['temperature-c'] = self._temperature
+                feeds['relative-humidity'] = self._relative_humidity
+            feeds['battery-percentage'] = self._battery_sensor.cell_percent
+            feeds['battery-voltage'] = self._battery_sensor.cell_voltage
+            if self.push_group_to_io('air-quality-office', feeds):
+                self.log.warning('Unable to push to Adafruit IO. Backing off.')
+                self.deep_sleep_exponential_backoff()
 
         if self._debug:
             from debug import print_particle_values
@@ -2,14 +2,18 @@
 #
 # SPDX-License-Identifier: Unlicense
 import alarm
-import board
-from constants import SLEEP_MEMORY_SLOT_PIN_ALARM
+from constants import ALARM_PINS, DEBUG, SLEEP_MEMORY_SLOT_PIN_ALARM
 
 # Handle pin alarms and store the specific button
-if alarm.wake_alarm:
-    if isinstance(alarm.wake_alarm, alarm.pin.PinAlarm):
-        pin_name = f'{alarm.wake_alarm.pin}'.split('.')[1]
-        print(f'Pin alarm from {pin_name}.')
-        alarm.sleep_memory[SLEEP_MEMORY_SLOT_PIN_ALARM] = dir(board).index(pin_name)
+if isinstance(alarm.wake_alarm, alarm.pin.PinAlarm):
+    for index, pin in enumerate(ALARM_PINS):
+        if alarm.wake_alarm.pin is pin:
+            alarm.sleep_memory[SLEEP_MEMORY_SLOT_PIN_ALARM] = index + 1
+            if DEBUG:
+                print(f'Pin alarm from {pin}.')
+            break
+else:
+    alarm.sleep_memory[SLEEP_MEMORY_SLOT_PIN_ALARM] = 0
 
-print('Boot complete.')
+if DEBUG:
+    print('Boot complete.')
@@ -2,9 +2,7 @@
 #
 # SPDX-License-Identifier: Unlicense
 from aq_magtag import AqMagTag
-
-DEBUG = False
-DEBUG_DISPLAY = False
+from constants import DEBUG, DEBUG_DISPLAY
 
 aq = AqMagTag(debug=DEBUG, debug_display=DEBUG_DISPLAY)
 aq.setup()
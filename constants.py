@@ -3,25 +3,79 @@
 # SPDX-License-Identifier: Unlicense
 import board
 import microcontroller
+from micropython import const
+
+# Per-build debug flags; const() lets mpy-cross fold module-level
+# branches that test them out of the compiled bytecode
+DEBUG = const(0)
+DEBUG_DISPLAY = const(0)
 
 # Amount of time to wait between refreshing the sensor data
-REFRESH_TIME = 10*60
+REFRESH_TIME = const(10*60)
+
+# Slot holding which button pin raised the wake alarm, as a 1-based index
+# into ALARM_PINS; 0 means no pin alarm
+SLEEP_MEMORY_SLOT_PIN_ALARM = const(0)
 
 # Constants used in sleep_memory to indicate error
-SLEEP_MEMORY_SLOT_BACKOFF = 1
-SLEEP_MEMORY_SLOT_BACKOFF_TIMES = 2
+SLEEP_MEMORY_SLOT_BACKOFF = const(1)
+SLEEP_MEMORY_SLOT_BACKOFF_TIMES = const(2)
+
+# First of four sleep_memory slots holding the monotonic time at which we
+# last entered deep sleep, stored as a little-endian 32-bit integer
+SLEEP_MEMORY_SLOT_LAST_WAKE = const(3)
+
+# Number of display refreshes skipped since the last real refresh
+SLEEP_MEMORY_SLOT_REFRESH_SKIPS = const(7)
+
+# First of three little-endian 16-bit sleep_memory slots holding the PM
+# values shown on screen
+SLEEP_MEMORY_SLOT_LAST_PM_VALUES = const(8)
+
+# How many wake cycles may reuse the displayed image before we force a refresh
+EINK_MAX_SKIPPED_REFRESHES = const(8)
 
 # Shortest time we will wait for backoff
-MINIMUM_BACKOFF = 15
+MINIMUM_BACKOFF = const(15)
 
 # Maximum length of backoff in seconds (5 minutes)
-MAXIMUM_BACKOFF = 60 * 5
+MAXIMUM_BACKOFF = const(60 * 5)
 
 # Maximum number of backoff iterations
-MAX_BACKOFF_COUNT = 60 / 5
+MAX_BACKOFF_COUNT = const(12)
+
+# Button pins that can raise a wake alarm, in SLEEP_MEMORY_SLOT_PIN_ALARM
+# index order
+ALARM_PINS = (board.D11, board.D12, board.D14, board.D15)
 
 # Pin used to control standby of the PM25 module
 PM25_STANDBY_PIN: microcontroller.Pin = board.D10
 
 # Duration of wait for PM25 sensor to spin up
-PM25_SENSOR_WARMUP_SECONDS = 30
+PM25_SENSOR_WARMUP_SECONDS = const(30)
+
+# Shorter stabilization wait when the sensor was running recently
+PM25_SENSOR_STABILIZE_SECONDS = const(5)
+
+# Soft limit on how long we keep collecting PM25 samples
+PM25_SAMPLE_BUDGET_SECONDS = const(20)
+
+# Only run garbage collection when free memory drops below this many bytes
+GC_MEM_FREE_THRESHOLD = const(8192)
+
+# Slot flagging that the EMA slots below hold data from a previous wake
+SLEEP_MEMORY_SLOT_EMA_VALID = const(30)
+
+# Slot counting wakes since the last full multi-sample reading
+SLEEP_MEMORY_SLOT_EMA_WAKES = const(31)
+
+# First of twelve little-endian 16-bit sleep_memory slots holding the
+# running average for each PM25 column
+SLEEP_MEMORY_SLOT_EMA_VALUES = const(32)
+
+# Take a fresh full multi-sample reading after this many single-sample wakes
+EMA_FULL_SAMPLE_INTERVAL = const(12)
+
+# First of seven sleep_memory slots caching the access point we last
+# associated with: channel (0 means no hint), then the six BSSID bytes
+SLEEP_MEMORY_SLOT_WIFI_HINT = const(16)
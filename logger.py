@@ -1,7 +1,5 @@
 import adafruit_logging as logging
 
-loggers = {}
-
 
 def get_logger(name: str) -> logging.Logger:
     """
@@ -10,6 +8,4 @@ def get_logger(name: str) -> logging.Logger:
     Args:
         name: unique name for this logger
     """
-    if name not in loggers.keys():
-        loggers[name] = logging.getLogger(name)
-    return loggers[name]
+    return logging.getLogger(name)